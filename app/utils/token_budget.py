@@ -0,0 +1,222 @@
+import re
+import logging
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 近似的每字符token数（DeepSeek系列分词器的经验值）
+CJK_TOKENS_PER_CHAR = 0.6
+ASCII_TOKENS_PER_CHAR = 0.3
+OTHER_TOKENS_PER_CHAR = 1.0
+
+# 模型上下文窗口及预算参数
+MODEL_CONTEXT_TOKENS = 65536
+# 约等于原先30000个中文字符的截断长度（30000 × 0.6），不扩大单次请求的输入规模
+MAX_INPUT_TOKENS = 18000
+# 审查意见的长度由固定的11部分模板决定而非文档大小，且max_tokens只是上限，
+# 因此保持原先的4000，仅在上下文窗口不足时下调
+OUTPUT_TOKENS = 4000
+SAFETY_MARGIN_TOKENS = 1024
+
+TRUNCATION_MARKER = "...(文本过长，已截断)"
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+_ASCII_RE = re.compile(r'[\x00-\x7f]')
+_INLINE_SPACE_RE = re.compile(r'[ \t\u00a0\u3000]+')
+
+# 样板行：由PDF转换而来的docx常把"第N页 共M页"等页码作为正文段落保留，
+# extract_text_from_docx不读取页眉页脚，因此这里只匹配带"页"/"page"字样的完整页码行
+_BOILERPLATE_RES = [
+    re.compile(r'^第\s*\d+\s*页(?:\s*[/，,]?\s*共\s*\d+\s*页)?$'),
+    re.compile(r'^(?i:page)\s*\d+(?:\s*(?i:of)\s*\d+)?$'),
+    re.compile(r'^[-—_=*·.\s]{3,}$'),
+]
+
+# 附图相关的噪声行：单独的图号、图片占位符
+_FIGURE_LABEL_RE = re.compile(r'^(?:图|(?i:fig(?:ure)?\.?))\s*\d+[a-zA-Z]?$')
+_IMAGE_PLACEHOLDER_RE = re.compile(r'^[\[【(（]?\s*(?:图片|图像|image|picture)\s*[\]】)）]?$', re.IGNORECASE)
+
+# 附图标记说明：只删除紧跟该标题、形如"1-壳体；2-底座"的标记列表，遇到第一条其他内容即结束
+_REFERENCE_HEADING_RE = re.compile(r'^附图标记(?:说明)?[:：]?$')
+# 每一项必须是裸数字编号+短名称；"."是步骤和权利要求的编号格式，不作为分隔符
+_REFERENCE_SIGN_RE = re.compile(r'^\d+[a-zA-Z]?\s*[-—、:：]\s*[^\d\s.．；;,，、:：]{1,12}$')
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in mixed Chinese/English text.
+
+    Args:
+        text (str): Text to estimate
+
+    Returns:
+        int: Estimated token count
+    """
+    if not text:
+        return 0
+    cjk_chars = len(_CJK_RE.findall(text))
+    ascii_chars = len(_ASCII_RE.findall(text))
+    other_chars = len(text) - cjk_chars - ascii_chars
+    estimate = (cjk_chars * CJK_TOKENS_PER_CHAR
+                + ascii_chars * ASCII_TOKENS_PER_CHAR
+                + other_chars * OTHER_TOKENS_PER_CHAR)
+    return int(estimate + 0.5)
+
+
+def _is_figure_noise(line):
+    return bool(_FIGURE_LABEL_RE.match(line) or _IMAGE_PLACEHOLDER_RE.match(line))
+
+
+def _is_reference_sign_list(line):
+    # 附图标记列表，如 "1-壳体；2-底座；3-支架"，所有项都符合格式时才成立
+    items = [item.strip() for item in re.split(r'[；;,，]', line) if item.strip()]
+    return bool(items) and all(_REFERENCE_SIGN_RE.match(item) for item in items)
+
+
+def compact_patent_text(text):
+    """
+    Compact patent text before sending it to the model.
+
+    Collapses repeated whitespace, drops page-number lines and figure
+    noise, and removes consecutive duplicate table rows. Reference-sign
+    lists are only dropped directly under a 附图标记 heading; the section
+    ends at the first line that is not such a list.
+
+    Args:
+        text (str): Text content of the patent document
+
+    Returns:
+        str: Compacted text
+    """
+    compacted = []
+    previous_table_row = None
+    in_reference_section = False
+    previous_blank = True
+    for raw_line in text.splitlines():
+        line = _INLINE_SPACE_RE.sub(" ", raw_line).strip()
+        if not line:
+            if not previous_blank:
+                compacted.append("")
+                previous_blank = True
+            continue
+        if any(pattern.match(line) for pattern in _BOILERPLATE_RES):
+            continue
+        if _is_figure_noise(line):
+            continue
+        if in_reference_section and _is_reference_sign_list(line):
+            continue
+        in_reference_section = bool(_REFERENCE_HEADING_RE.match(line))
+        # extract_text_from_docx 以 " | " 连接表格单元格；不跨表格去重，只合并相邻的重复行
+        if " | " in line and line == previous_table_row:
+            continue
+        previous_table_row = line if " | " in line else None
+        compacted.append(line)
+        previous_blank = False
+    return "\n".join(compacted).strip()
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Truncate text so that its estimated token count fits within max_tokens.
+
+    Args:
+        text (str): Text to truncate
+        max_tokens (int): Token budget for the text
+
+    Returns:
+        str: Original text if it fits, otherwise truncated text with a marker
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分查找加上截断标记后仍满足预算的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid] + TRUNCATION_MARKER) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + TRUNCATION_MARKER
+
+
+def plan_token_budget(system_prompt, user_prefix, patent_text):
+    """
+    Compact the patent text and size input/output token budgets for one request.
+
+    Args:
+        system_prompt (str): System prompt sent with the request
+        user_prefix (str): Instruction text placed before the patent text
+        patent_text (str): Text content of the patent document
+
+    Returns:
+        dict: Plan containing the compacted ``patent_text``, ``max_tokens``
+            and estimated token counts
+    """
+    original_tokens = estimate_tokens(patent_text)
+    compacted = compact_patent_text(patent_text)
+    compacted_tokens = estimate_tokens(compacted)
+    prompt_overhead = estimate_tokens(system_prompt) + estimate_tokens(user_prefix)
+
+    input_budget = min(
+        MAX_INPUT_TOKENS,
+        MODEL_CONTEXT_TOKENS - prompt_overhead - OUTPUT_TOKENS - SAFETY_MARGIN_TOKENS
+    )
+    truncated = compacted_tokens > input_budget
+    if truncated:
+        logger.warning(f"专利文本过长(估算{compacted_tokens} tokens)，将被截断至{input_budget} tokens")
+        compacted = truncate_to_tokens(compacted, input_budget)
+    document_tokens = estimate_tokens(compacted)
+
+    # 输出预算仅在上下文窗口剩余空间不足时下调
+    max_tokens = min(OUTPUT_TOKENS,
+                     MODEL_CONTEXT_TOKENS - prompt_overhead - document_tokens - SAFETY_MARGIN_TOKENS)
+
+    return {
+        "patent_text": compacted,
+        "max_tokens": max_tokens,
+        "original_chars": len(patent_text),
+        "compacted_chars": len(compacted),
+        "original_tokens": original_tokens,
+        "compacted_tokens": compacted_tokens,
+        "estimated_prompt_tokens": prompt_overhead + document_tokens,
+        "truncated": truncated,
+    }
+
+
+def build_token_report(plan, usage, finish_reason=None):
+    """
+    Compare the planner's estimates with the token usage reported by the API.
+
+    Args:
+        plan (dict): Plan returned by plan_token_budget
+        usage (dict): ``usage`` object from the API response
+        finish_reason (str): ``choices[0].finish_reason`` from the API response
+
+    Returns:
+        dict: Estimated vs. actual token counts, for tuning the estimator
+    """
+    report = {
+        "original_chars": plan["original_chars"],
+        "compacted_chars": plan["compacted_chars"],
+        "original_tokens": plan["original_tokens"],
+        "compacted_tokens": plan["compacted_tokens"],
+        "truncated": plan["truncated"],
+        "max_tokens": plan["max_tokens"],
+        "estimated_prompt_tokens": plan["estimated_prompt_tokens"],
+        "actual_prompt_tokens": None,
+        "actual_completion_tokens": None,
+        "prompt_estimate_ratio": None,
+        "finish_reason": finish_reason,
+    }
+    if usage:
+        report["actual_prompt_tokens"] = usage.get("prompt_tokens")
+        report["actual_completion_tokens"] = usage.get("completion_tokens")
+        if report["actual_prompt_tokens"]:
+            report["prompt_estimate_ratio"] = round(
+                plan["estimated_prompt_tokens"] / report["actual_prompt_tokens"], 3)
+    logger.info(f"token估算: 输入估算{report['estimated_prompt_tokens']}, "
+                f"实际{report['actual_prompt_tokens']}, 输出实际{report['actual_completion_tokens']}, "
+                f"结束原因{finish_reason}")
+    if finish_reason == "length":
+        logger.warning(f"审查意见达到max_tokens={plan['max_tokens']}上限，输出已被截断")
+    return report
@@ -0,0 +1,13 @@
+import os
+import sys
+import types
+
+# 将项目根目录添加到Python路径
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+# app/__init__.py 会创建Flask应用；测试只导入纯函数模块，因此注册空的app包跳过其初始化
+if "app" not in sys.modules:
+    app_package = types.ModuleType("app")
+    app_package.__path__ = [os.path.join(ROOT, "app")]
+    sys.modules["app"] = app_package
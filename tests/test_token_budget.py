@@ -0,0 +1,88 @@
+from app.utils.token_budget import (
+    OUTPUT_TOKENS,
+    TRUNCATION_MARKER,
+    build_token_report,
+    compact_patent_text,
+    estimate_tokens,
+    plan_token_budget,
+    truncate_to_tokens,
+)
+
+
+def test_estimate_tokens_mixed_text():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("专利审查") == 2        # 4 × 0.6 = 2.4
+    assert estimate_tokens("patent") == 2          # 6 × 0.3 = 1.8
+    assert estimate_tokens("一种装置device") == 4  # 4 × 0.6 + 6 × 0.3 = 4.2
+
+
+def test_truncate_to_tokens_within_budget():
+    text = "技术方案" * 1000
+    truncated = truncate_to_tokens(text, 500)
+    assert truncated.endswith(TRUNCATION_MARKER)
+    assert estimate_tokens(truncated) <= 500
+    assert truncate_to_tokens("短文本", 500) == "短文本"
+
+
+def test_compact_collapses_whitespace_and_noise():
+    text = "一种   装置\n\n\n\n第 1 页 共 3 页\n图1\n[图片]\n技术领域"
+    assert compact_patent_text(text) == "一种 装置\n\n技术领域"
+
+
+def test_compact_dedupes_only_consecutive_table_rows():
+    text = "名称 | 数值\n名称 | 数值\n样品 | 100 | 合格\n样品 | 200 | 合格\n样品 | 100 | 合格\n名称 | 数值"
+    assert compact_patent_text(text) == (
+        "名称 | 数值\n样品 | 100 | 合格\n样品 | 200 | 合格\n样品 | 100 | 合格\n名称 | 数值"
+    )
+
+
+def test_compact_drops_reference_signs_only_under_heading():
+    text = "附图标记说明\n1-壳体；2-底座；3-支架\n4、螺钉\n具体实施方式\n1-壳体；2-底座；3-支架"
+    assert compact_patent_text(text) == "附图标记说明\n具体实施方式\n1-壳体；2-底座；3-支架"
+
+
+def test_compact_keeps_embodiments_after_drawing_description():
+    texts = [
+        "附图说明\n图1为本发明结构示意图\n五、具体实施方式\n1、加热；2、冷却；3、搅拌",
+        "附图说明\n图1为本发明结构示意图\n具体实施例\n实施例1\n1、加热\n2、冷却",
+        "附图标记说明\n1-壳体\n[0025]具体实施方式\n1、加热\n2、冷却",
+    ]
+    expected = [
+        texts[0],
+        texts[1],
+        "附图标记说明\n[0025]具体实施方式\n1、加热\n2、冷却",
+    ]
+    for text, result in zip(texts, expected):
+        assert compact_patent_text(text) == result
+
+
+def test_compact_keeps_steps_claims_and_numbers():
+    lines = [
+        "S1.获取数据；S2.处理数据；S3.输出结果",
+        "步骤：1.加热；2.冷却；3.搅拌",
+        "1.一种装置；2.根据权利要求1所述；3.根据",
+        "2024",
+        "100",
+    ]
+    for line in lines:
+        assert compact_patent_text(line) == line
+        assert compact_patent_text("附图标记说明\n" + line) == "附图标记说明\n" + line
+
+
+def test_plan_token_budget_output_tokens():
+    small = plan_token_budget("系统", "用户", "一种装置")
+    assert small["max_tokens"] == OUTPUT_TOKENS
+    assert not small["truncated"]
+
+    large = plan_token_budget("系统", "用户", "技术方案" * 20000)
+    assert large["max_tokens"] == OUTPUT_TOKENS
+    assert large["truncated"]
+    assert large["patent_text"].endswith(TRUNCATION_MARKER)
+
+
+def test_build_token_report_records_finish_reason():
+    plan = plan_token_budget("系统", "用户", "一种装置")
+    report = build_token_report(plan, {"prompt_tokens": 10, "completion_tokens": 4000}, "length")
+    assert report["finish_reason"] == "length"
+    assert report["actual_completion_tokens"] == 4000
+    assert build_token_report(plan, {})["finish_reason"] is None